@@ -1,22 +1,23 @@
 """Init for Elehant Water integration."""
 from __future__ import annotations
 
-import asyncio
 from datetime import timedelta
 import logging
 
+from homeassistant.components import bluetooth
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import Platform
 from homeassistant.core import HomeAssistant
+from homeassistant.helpers.debounce import Debouncer
 from homeassistant.helpers.update_coordinator import DataUpdateCoordinator
 
 from .const import (
     CONF_COUNTERS,
+    CONF_COUNTER_ID,
     CONF_SCAN_INTERVAL,
     DEFAULT_SCAN_INTERVAL,
     DATA_COORDINATOR,
     DATA_CONFIG,
-    DATA_DEVICES,
     DATA_SCANNER,
     DOMAIN,
 )
@@ -27,49 +28,77 @@ _LOGGER = logging.getLogger(__name__)
 PLATFORMS: list[Platform] = [Platform.SENSOR]
 
 
+class ElehantCoordinator(DataUpdateCoordinator):
+    """Coordinator reading readings straight from the scanner."""
+
+    def __init__(
+        self, hass: HomeAssistant, scanner: ElehantScanner, scan_interval: int
+    ) -> None:
+        """Initialize coordinator."""
+        super().__init__(
+            hass,
+            _LOGGER,
+            name=DOMAIN,
+            # Интервал остается как страховочное обновление; основной поток
+            # данных идет от сканера через async_request_refresh
+            update_interval=timedelta(seconds=scan_interval),
+            # Счетчики повторяют одни и те же показания — не будим сенсоры без изменений
+            always_update=False,
+            # BLE-пакеты приходят сериями (три канала за ~10 мс) — склеиваем их
+            request_refresh_debouncer=Debouncer(
+                hass, _LOGGER, cooldown=0.35, immediate=True
+            ),
+        )
+        self.scanner = scanner
+
+    async def _async_update_data(self) -> dict:
+        """Fetch the latest snapshot from the scanner."""
+        return await self.scanner.async_update()
+
+
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Set up Elehant Water from a config entry."""
     # Инициализация данных в hass.data
     hass.data.setdefault(DOMAIN, {})
     
+    # Опции перекрывают данные записи; объединяем один раз
+    merged = {**entry.data, **entry.options}
+
     # Сохраняем конфигурацию
     config = {
-        CONF_COUNTERS: entry.data.get(CONF_COUNTERS, []),
+        CONF_COUNTERS: merged.get(CONF_COUNTERS, []),
     }
-    
-    # Добавляем опции
-    scan_interval = entry.options.get(
-        CONF_SCAN_INTERVAL, 
-        entry.data.get(CONF_SCAN_INTERVAL, DEFAULT_SCAN_INTERVAL)
-    )
-    
+
+    scan_interval = merged.get(CONF_SCAN_INTERVAL, DEFAULT_SCAN_INTERVAL)
+
+
     hass.data[DOMAIN][entry.entry_id] = {
         DATA_CONFIG: config,
-        DATA_DEVICES: {},  # Здесь будут храниться данные счетчиков {counter_id: {state, attributes}}
         DATA_SCANNER: None,
         DATA_COORDINATOR: None,
     }
 
-    # Создаем сканер Bluetooth
-    scanner = ElehantScanner(hass, entry.entry_id)
+    # Наличие адаптеров узнаем у интеграции bluetooth (данные уже в кэше HA),
+    # а не пробным созданием BleakScanner
+    if bluetooth.async_scanner_count(hass, connectable=False) == 0:
+        _LOGGER.warning(
+            "No Bluetooth scanners available; Elehant counters will not update"
+        )
+
+    # Создаем сканер Bluetooth; передаем настроенные ID, чтобы чужие
+    # счетчики отсеивались до разбора пакета
+    counter_ids = [c[CONF_COUNTER_ID] for c in config[CONF_COUNTERS]]
+    scanner = ElehantScanner(hass, entry.entry_id, counter_ids)
     hass.data[DOMAIN][entry.entry_id][DATA_SCANNER] = scanner
 
     # Создаем координатор для обновления данных
-    async def async_update_data():
-        """Update data from Bluetooth scanner."""
-        return await scanner.async_update()
-
-    coordinator = DataUpdateCoordinator(
-        hass,
-        _LOGGER,
-        name=DOMAIN,
-        update_method=async_update_data,
-        update_interval=timedelta(seconds=scan_interval),
-    )
-    
+    coordinator = ElehantCoordinator(hass, scanner, scan_interval)
+
     hass.data[DOMAIN][entry.entry_id][DATA_COORDINATOR] = coordinator
+    scanner.coordinator = coordinator
 
-    # Первое обновление данных
+    # Запускаем непрерывное сканирование и делаем первое обновление
+    await scanner.async_start()
     await coordinator.async_config_entry_first_refresh()
 
     # Настраиваем платформы
@@ -86,8 +115,10 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         if scanner:
             await scanner.async_stop()
         
-        # Удаляем данные
+        # Удаляем данные; последняя запись забирает с собой и словарь домена
         hass.data[DOMAIN].pop(entry.entry_id)
+        if not hass.data[DOMAIN]:
+            hass.data.pop(DOMAIN)
 
     return unload_ok
 
@@ -7,9 +7,7 @@ from typing import Any
 import voluptuous as vol
 
 from homeassistant import config_entries
-from homeassistant.core import HomeAssistant
 from homeassistant.data_entry_flow import FlowResult
-from homeassistant.exceptions import HomeAssistantError
 
 from .const import (
     CONF_COUNTERS,
@@ -20,6 +18,7 @@ from .const import (
     COUNTER_TYPE_WATER,
     COUNTER_TYPE_GAS,
     DEFAULT_SCAN_INTERVAL,
+    DEVICE_ID_RE,
     DOMAIN,
 )
 
@@ -43,6 +42,10 @@ STEP_COUNTER_SCHEMA = vol.Schema(
     }
 )
 
+STEP_COUNTER_CONFIRM_SCHEMA = vol.Schema(
+    {vol.Optional("add_another", default=False): bool}
+)
+
 
 class ElehantConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     """Handle a config flow for Elehant Water."""
@@ -78,13 +81,16 @@ class ElehantConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         errors = {}
 
         if user_input is not None:
-            # Проверяем уникальность ID
+            # Проверяем формат и уникальность ID
             counter_id = user_input[CONF_COUNTER_ID]
+            # Серийник в эфире занимает 3 байта — ID больше 2^24 не бывает
+            if not DEVICE_ID_RE.match(counter_id) or int(counter_id) >= 1 << 24:
+                errors["base"] = "invalid_id"
             for counter in self.data[CONF_COUNTERS]:
                 if counter[CONF_COUNTER_ID] == counter_id:
                     errors["base"] = "id_exists"
                     break
-            else:
+            if not errors:
                 # Добавляем счетчик
                 counter_data = {
                     CONF_COUNTER_ID: counter_id,
@@ -112,8 +118,5 @@ class ElehantConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             return self.async_create_entry(title="Elehant Water", data=self.data)
 
         return self.async_show_form(
-            step_id="counter_confirm",
-            data_schema=vol.Schema(
-                {vol.Optional("add_another", default=False): bool}
-            ),
+            step_id="counter_confirm", data_schema=STEP_COUNTER_CONFIRM_SCHEMA
         )
@@ -1,7 +1,12 @@
 """Constants for the Elehant Water integration."""
+import re
 
 DOMAIN = "elehant_water_new"
 
+# ID счетчика — десятичный серийный номер; компилируем один раз,
+# проверка используется и в config flow, и в сканере
+DEVICE_ID_RE = re.compile(r"\A\d{3,10}\Z")
+
 # Конфигурация
 CONF_COUNTERS = "counters"
 CONF_COUNTER_ID = "counter_id"
@@ -16,6 +21,9 @@ COUNTER_TYPE_GAS = "gas"
 CONF_SCAN_INTERVAL = "scan_interval"
 DEFAULT_SCAN_INTERVAL = 60
 
+# Идентификатор производителя в manufacturer data рекламы BLE
+MANUFACTURER_ID_ELEHANT = 0xFFFF
+
 # MAC-маски для определения производителя и типа устройства
 # Счетчики воды СГБТ (газ?) / Возможно газовые счетчики
 MAC_MASK_GAS = [
@@ -43,10 +51,22 @@ MAC_MASK_WATER_DUAL = [
 # Все маски для воды (для удобства проверки)
 MAC_MASK_WATER = MAC_MASK_WATER_TEMP + MAC_MASK_WATER_DUAL
 
+# Те же префиксы как 24-битные числа: сканер проверяет каждый пакет,
+# поэтому вместо перебора строк — одна проверка вхождения в frozenset
+PREFIX_GAS = frozenset(int(m.replace(':', ''), 16) for m in MAC_MASK_GAS)
+PREFIX_WATER_TEMP = frozenset(int(m.replace(':', ''), 16) for m in MAC_MASK_WATER_TEMP)
+PREFIX_WATER_DUAL = frozenset(int(m.replace(':', ''), 16) for m in MAC_MASK_WATER_DUAL)
+
+# Единая карта префикс -> тип устройства: определение типа за один поиск
+PREFIX_TYPE_MAP = (
+    {p: "gas" for p in PREFIX_GAS}
+    | {p: "water_temp" for p in PREFIX_WATER_TEMP}
+    | {p: "water_dual" for p in PREFIX_WATER_DUAL}
+)
+
 # Ключи для хранения данных в hass.data
 DATA_COORDINATOR = "coordinator"
 DATA_CONFIG = "config"
-DATA_DEVICES = "devices"
 DATA_SCANNER = "scanner"
 
 # Атрибуты сенсоров
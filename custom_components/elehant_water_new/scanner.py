@@ -1,25 +1,23 @@
 """Bluetooth scanner for Elehant devices."""
-import asyncio
-from collections import defaultdict
-from datetime import datetime
+from dataclasses import dataclass
+from datetime import datetime, timedelta
 import logging
 import struct
-from typing import Any
 
-from bleak import BleakScanner
-from bleak.backends.device import BLEDevice
-from bleak.backends.scanner import AdvertisementData
-
-from homeassistant.core import HomeAssistant
+from homeassistant.components import bluetooth
+from homeassistant.components.bluetooth import (
+    BluetoothCallbackMatcher,
+    BluetoothChange,
+    BluetoothScanningMode,
+    BluetoothServiceInfoBleak,
+)
+from homeassistant.core import HomeAssistant, callback
 
 from .const import (
-    MAC_MASK_GAS,
-    MAC_MASK_WATER,
-    MAC_MASK_WATER_DUAL,
-    MAC_MASK_WATER_TEMP,
+    DEVICE_ID_RE,
+    MANUFACTURER_ID_ELEHANT,
+    PREFIX_TYPE_MAP,
     ATTR_BATTERY_LEVEL,
-    ATTR_RSSI,
-    ATTR_LAST_SEEN,
     ATTR_TEMPERATURE,
     ATTR_TARIFF_1,
     ATTR_TARIFF_2,
@@ -28,92 +26,289 @@ from .const import (
 
 _LOGGER = logging.getLogger(__name__)
 
+# Литры -> м³: умножение на предвычисленный множитель вместо деления
+_SCALE_M3 = 0.001
+
+# Счетчик считаем пропавшим, если пакетов нет дольше этого срока
+# (реклама идет каждые несколько секунд — 5 минут это десятки пропусков)
+_STALE_TIMEOUT = timedelta(minutes=5)
+
+# Предел кэшей, ключуемых по MAC: телефоны со случайными адресами тоже
+# шлют manufacturer id 0xFFFF, без предела кэши росли бы бесконечно
+_CACHE_MAX = 256
+
+# Форматы пакетов компилируем один раз при импорте: struct.Struct.unpack_from
+# разбирает все поля за один вызов без промежуточных срезов
+# serial [6:9] LE, показание [9:13] LE u32
+_GAS_STRUCT = struct.Struct("<6x3sI")
+# serial [6:9], показание [9:13], температура [14:16] LE /100
+_WATER_TEMP_STRUCT = struct.Struct("<6x3sIxH")
+# serial [6:9], тариф 1 [9:13], тариф 2 [13:17]
+_WATER_DUAL_STRUCT = struct.Struct("<6x3sII")
+# то же + текущий тариф [17] в пакетах полной длины
+_WATER_DUAL_STRUCT_FULL = struct.Struct("<6x3sIIB")
+
+# Минимальная длина пакета по типу устройства: короткие/обрезанные пакеты
+# отбрасываются одним сравнением еще в колбэке, до вызова парсера.
+# Для СВД минимум — серийник плюс показание: пакет без хвоста
+# с температурой все равно несет показание
+_MIN_PACKET_LEN = {
+    "gas": _GAS_STRUCT.size,
+    "water_temp": _GAS_STRUCT.size,
+    "water_dual": _WATER_DUAL_STRUCT.size,
+}
+
+# Связанные методы unpack_from: в парсерах остается один LOAD_FAST
+# вместо пары подъемов атрибута на каждый пакет
+_GAS_UNPACK = _GAS_STRUCT.unpack_from
+_WATER_TEMP_UNPACK = _WATER_TEMP_STRUCT.unpack_from
+_WATER_DUAL_UNPACK = _WATER_DUAL_STRUCT.unpack_from
+_WATER_DUAL_FULL_UNPACK = _WATER_DUAL_STRUCT_FULL.unpack_from
+
+
+def _counter_id(serial: bytes) -> str:
+    """Десятичный ID счетчика из сырых 3 байт серийника (LE).
+
+    Общий для всех трех парсеров — одна точка, если формат
+    серийника когда-нибудь поменяется.
+    """
+    return str(int.from_bytes(serial, byteorder='little'))
+
+
+def _evict_oldest(cache: dict, *companions: dict) -> None:
+    """Удалить старейшую запись кэша при достижении предела.
+
+    FIFO-вытеснение по порядку вставки: случайный MAC больше не
+    вернется, а живое устройство после вытеснения просто разберется
+    заново на следующем пакете. Спутники — словари с тем же ключом,
+    вытесняются синхронно, чтобы кэши не расходились.
+    """
+    if len(cache) >= _CACHE_MAX:
+        oldest = next(iter(cache))
+        del cache[oldest]
+        for companion in companions:
+            companion.pop(oldest, None)
+
+
+@dataclass(frozen=True, slots=True)
+class ElehantReading:
+    """Одно разобранное показание счетчика.
+
+    Неизменяемый объект со slots: дешевле словаря и сравнивается
+    по полям на C-уровне, что важно при always_update=False.
+    """
+
+    counter_id: str
+    name: str
+    mac: str
+    device_type: str
+    state: float
+    battery_level: int | None = None
+    temperature: float | None = None
+    tariff_1: float | None = None
+    tariff_2: float | None = None
+    current_tariff: int | None = None
+
 
 class ElehantScanner:
     """Scanner for Elehant devices."""
 
-    def __init__(self, hass: HomeAssistant, entry_id: str) -> None:
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        entry_id: str,
+        counter_ids: list[str] | None = None,
+    ) -> None:
         """Initialize scanner."""
         self.hass = hass
         self.entry_id = entry_id
-        self._scanner = None
-        self._scanning = False
-        self._devices = defaultdict(dict)  # Временное хранилище найденных устройств
+        # Настроенные ID счетчиков как сырые 3-байтовые серийники (LE) —
+        # в колбэке сравниваем срез пакета напрямую, без int/str.
+        # Пустой набор означает "принимать все"
+        serials = []
+        for cid in counter_ids or ():
+            if cid.isdigit() and int(cid) < 1 << 24:
+                serials.append(int(cid).to_bytes(3, 'little'))
+            else:
+                # Такой ID не влезает в 3-байтовый серийник в эфире — фильтр
+                # его просто не увидит; молча менять семантику фильтра нельзя
+                _LOGGER.warning(
+                    "Counter ID %s cannot match the 3-byte on-air serial"
+                    " and will never receive data",
+                    cid,
+                )
+        self._configured_serials = frozenset(serials)
+        self.coordinator = None  # Назначается в async_setup_entry
+        self._cancel_callback = None
+        self._devices: dict[str, ElehantReading] = {}  # Последние показания по ID счетчика
+        # RSSI и время последнего пакета храним отдельно от данных координатора:
+        # они меняются на каждом пакете и ломали бы сравнение при always_update=False.
+        # Плоские параллельные словари вместо вложенных — без аллокации
+        # внутреннего словаря на каждый пакет
+        self.rssi: dict[str, int] = {}
+        self.last_seen: dict[str, datetime] = {}
+        # Реклама BLE повторяет одни и те же байты несколько раз в секунду —
+        # запоминаем последний пакет и результат разбора, чтобы не парсить повторы
+        self._last_payload: dict[str, bytes] = {}
+        self._last_parsed: dict[str, ElehantReading] = {}
+        # Тип устройства — чистая функция MAC-адреса: считаем один раз на адрес
+        # (None тоже кэшируем, чтобы чужие устройства отсеивались мгновенно)
+        self._mac_type_cache: dict[str, str | None] = {}
 
-    async def async_update(self) -> dict[str, Any]:
-        """Scan for devices and update data."""
-        found_devices = {}
-        
-        def detection_callback(device: BLEDevice, advertisement_data: AdvertisementData):
-            """Callback for device detection."""
-            if not advertisement_data or not advertisement_data.manufacturer_data:
-                return
-            
-            mac = device.address.lower()
-            
-            # Проверяем, принадлежит ли устройство Elehant
-            device_type = self._identify_device(mac)
-            if not device_type:
-                return
-            
-            # Парсим данные
-            parsed_data = self._parse_advertisement_data(advertisement_data, device_type)
-            if not parsed_data:
-                return
-            
-            # Сохраняем во временное хранилище
-            self._devices[mac] = {
-                "name": device.name or f"Elehant {mac[-5:]}",
-                "mac": mac,
-                "device_type": device_type,
-                "rssi": device.rssi,
-                "last_seen": datetime.now(),
-                **parsed_data
-            }
-            
-            _LOGGER.debug(f"Found Elehant device: {mac}, type: {device_type}, data: {parsed_data}")
-
-        # Запускаем сканирование на 10 секунд
-        self._scanner = BleakScanner(detection_callback)
-        await self._scanner.start()
-        await asyncio.sleep(10)
-        await self._scanner.stop()
-        
-        # Копируем найденные устройства
-        found_devices = dict(self._devices)
-        self._devices.clear()
+    @callback
+    def _async_handle_service_info(
+        self,
+        service_info: BluetoothServiceInfoBleak,
+        change: BluetoothChange,
+        # Горячие глобальные имена, связанные при определении функции:
+        # LOAD_FAST вместо LOAD_GLOBAL на каждый пакет
+        _mfr_id: int = MANUFACTURER_ID_ELEHANT,
+        _min_len: dict = _MIN_PACKET_LEN,
+    ) -> None:
+        """Handle an advertisement from the shared HA scanner."""
+        if not service_info.manufacturer_data:
+            return
+
+        mac = service_info.address.lower()
+
+        # Проверяем, принадлежит ли устройство Elehant (результат мемоизирован)
+        if mac in self._mac_type_cache:
+            device_type = self._mac_type_cache[mac]
+        else:
+            # RSSI и last_seen ключуются тем же MAC — вытесняем заодно
+            _evict_oldest(self._mac_type_cache, self.rssi, self.last_seen)
+            device_type = self._mac_type_cache[mac] = self._identify_device(mac)
+        if not device_type:
+            return
         
-        return found_devices
+        self.rssi[mac] = service_info.rssi
+        self.last_seen[mac] = datetime.now()
+
+        # Известный ID производителя пробуем напрямую, без итератора;
+        # на нестандартный ID отступаем к первой записи
+        man_data = service_info.manufacturer_data.get(_mfr_id)
+        if man_data is None:
+            man_data = next(iter(service_info.manufacturer_data.values()))
+        # Сравниваем сами байты: это memcmp без риска коллизий хэша
+        # (bytes == bytearray работает без копирования)
+        if self._last_payload.get(mac) == man_data:
+            cached = self._last_parsed.get(mac)
+            if cached is not None:
+                self._devices[cached.counter_id] = cached
+            return
+        if type(man_data) is not bytes:
+            # На некоторых бэкендах bleak отдает bytearray; копируем только
+            # изменившиеся пакеты — дальше нужны хэшируемые срезы
+            man_data = bytes(man_data)
+
+        # Обрезанные пакеты отсеиваем по минимальной длине для типа устройства —
+        # парсер дальше работает без проверок длины
+        if len(man_data) < _min_len[device_type]:
+            return
+
+        # Чужие счетчики (например, соседские) отсеиваем по серийному номеру
+        # до полного разбора пакета; сравнение — memcmp трех байт.
+        # Набор счетчиков фиксирован до перезагрузки записи, поэтому отказ
+        # запоминаем по MAC — следующие пакеты отпадут на первой проверке
+        if self._configured_serials and man_data[6:9] not in self._configured_serials:
+            self._mac_type_cache[mac] = None
+            _evict_oldest(self._last_payload, self._last_parsed)
+            self._last_payload[mac] = man_data
+            return
+
+        # Парсим данные
+        parsed_data = self._parse_advertisement_data(man_data, device_type)
+        if not parsed_data:
+            return
+
+        # Отбрасываем пакеты с мусорным серийным номером; после фильтра по
+        # настроенным серийникам номер уже проверен при настройке
+        if not self._configured_serials and not DEVICE_ID_RE.match(
+            parsed_data["counter_id"]
+        ):
+            return
+
+        # Сохраняем последнее показание; ключ — ID счетчика,
+        # чтобы сенсоры находили свои данные одним обращением к словарю
+        reading = ElehantReading(
+            name=service_info.name or f"Elehant {mac[-5:]}",
+            mac=mac,
+            device_type=device_type,
+            **parsed_data,
+        )
+        self._devices[reading.counter_id] = reading
+        _evict_oldest(self._last_payload, self._last_parsed)
+        self._last_payload[mac] = man_data
+        self._last_parsed[mac] = reading
+
+        # Ленивое форматирование: строка не собирается, если debug выключен
+        _LOGGER.debug(
+            "Found Elehant device: %s, type: %s, data: %s", mac, device_type, parsed_data
+        )
+
+        # Показания изменились — просим координатор обновиться.
+        # Debouncer склеивает всплески пакетов в одно обновление
+        if self.coordinator is not None:
+            self.hass.async_create_task(self.coordinator.async_request_refresh())
+
+    async def async_start(self) -> None:
+        """Subscribe to advertisements from HA's shared Bluetooth scanner."""
+        # Идемпотентность обеспечивает сам cancel-колбэк — отдельный флаг
+        # состояния не нужен
+        if self._cancel_callback is not None:
+            return
+
+        # Подписываемся на общий сканер HA вместо собственного BleakScanner:
+        # не плодим второй поток сканирования на том же радио. Фильтр по
+        # manufacturer id отрабатывает еще в диспетчере bluetooth.
+        # Пассивный режим: счетчики шлют все данные в самой рекламе,
+        # scan response не нужен — не заставляем радио слать запросы
+        self._cancel_callback = bluetooth.async_register_callback(
+            self.hass,
+            self._async_handle_service_info,
+            BluetoothCallbackMatcher(
+                manufacturer_id=MANUFACTURER_ID_ELEHANT, connectable=False
+            ),
+            BluetoothScanningMode.PASSIVE,
+        )
+
+        # Одноразовый прогрев из кэша рекламы HA: показания появляются
+        # сразу после перезагрузки, не дожидаясь следующего пакета.
+        # Дальше работает только колбэк — повторных обходов кэша нет
+        for service_info in bluetooth.async_discovered_service_info(
+            self.hass, connectable=False
+        ):
+            self._async_handle_service_info(
+                service_info, BluetoothChange.ADVERTISEMENT
+            )
+
+    async def async_update(self) -> dict[str, ElehantReading]:
+        """Return the latest readings collected by the continuous scan."""
+        # Выбрасываем показания замолчавших счетчиков: снимок меняется,
+        # координатор замечает это несмотря на always_update=False,
+        # и сенсор становится недоступным. Живые счетчики возвращаются
+        # в словарь с каждым пакетом, включая повторы из дедуп-кэша
+        now = datetime.now()
+        for counter_id in [
+            counter_id
+            for counter_id, reading in self._devices.items()
+            if now - self.last_seen.get(reading.mac, now) > _STALE_TIMEOUT
+        ]:
+            del self._devices[counter_id]
+        return dict(self._devices)
 
     def _identify_device(self, mac: str) -> str | None:
         """Identify device type by MAC address."""
-        mac_lower = mac.lower()
-        
-        # Проверяем газовые счетчики
-        for mask in MAC_MASK_GAS:
-            if mask in mac_lower:
-                return "gas"
-        
-        # Проверяем водяные счетчики с температурой
-        for mask in MAC_MASK_WATER_TEMP:
-            if mask in mac_lower:
-                return "water_temp"
-        
-        # Проверяем двухтарифные водяные счетчики
-        for mask in MAC_MASK_WATER_DUAL:
-            if mask in mac_lower:
-                return "water_dual"
-        
-        return None
+        try:
+            prefix = int(mac.replace(':', ''), 16) >> 24
+        except ValueError:
+            return None
 
-    def _parse_advertisement_data(self, adv_data: AdvertisementData, device_type: str) -> dict | None:
+        # Тип устройства — одним поиском по общей карте префиксов
+        return PREFIX_TYPE_MAP.get(prefix)
+
+    def _parse_advertisement_data(self, man_data: bytes, device_type: str) -> dict | None:
         """Parse manufacturer specific data."""
-        if not adv_data.manufacturer_data:
-            return None
-        
-        # Берем первый (и обычно единственный) manufacturer data
-        man_data = next(iter(adv_data.manufacturer_data.values()))
-        
         try:
             # Парсим данные в зависимости от типа устройства
             if device_type == "gas":
@@ -122,67 +317,86 @@ class ElehantScanner:
                 return self._parse_water_temp_data(man_data)
             elif device_type == "water_dual":
                 return self._parse_water_dual_data(man_data)
-        except Exception as e:
-            _LOGGER.error(f"Error parsing data for {device_type}: {e}")
-        
+        except (struct.error, IndexError):
+            # Битый пакет — ожидаемая ситуация в эфире; настоящие ошибки
+            # парсера не глушим широким except, их поднимет диспетчер bluetooth
+            _LOGGER.debug("Malformed packet for %s: %s", device_type, man_data)
+
         return None
 
     def _parse_gas_data(self, data: bytes) -> dict:
         """Parse gas counter data."""
         # Пример: СГБТ-1.8, СГБТ-3.2, СГБТ-4.0, СГБТ-4.0 ТК, СОНИК G4ТК
-        # Структура из оригинального кода
-        counter_num = int.from_bytes(data[6:9], byteorder='little')
-        counter_count = int.from_bytes(data[9:13], byteorder='little')
-        
+        serial, counter_count = _GAS_UNPACK(data)
+
         # Преобразование в зависимо от типа (в оригинале была логика для gas/water)
         # Скорее всего это показания в литрах, преобразуем в м³
-        count = counter_count / 1000
-        
+        count = counter_count * _SCALE_M3
+
         return {
-            "counter_id": str(counter_num),
+            "counter_id": _counter_id(serial),
             "state": count,
-            "battery_level": None,  # В оригинале не было
+            ATTR_BATTERY_LEVEL: None,  # В оригинале не было
         }
 
     def _parse_water_temp_data(self, data: bytes) -> dict:
         """Parse water counter with temperature (СВД-15, СВД-20)."""
-        # Структура из оригинального кода
-        counter_num = int.from_bytes(data[6:9], byteorder='little')
-        counter_count = int.from_bytes(data[9:13], byteorder='little')
-        temperature = int.from_bytes(data[14:16], byteorder="little") / 100
-        
-        count = counter_count / 1000  # Преобразуем в м³
-        
+        # Ветвление по длине: обрезанный пакет без хвоста с температурой
+        # разбираем коротким форматом, показание не теряем
+        if len(data) >= _WATER_TEMP_STRUCT.size:
+            serial, counter_count, temperature_raw = _WATER_TEMP_UNPACK(data)
+            temperature = temperature_raw / 100
+        else:
+            serial, counter_count = _GAS_UNPACK(data)
+            temperature = None
+
+        count = counter_count * _SCALE_M3  # Преобразуем в м³
+
         return {
-            "counter_id": str(counter_num),
+            "counter_id": _counter_id(serial),
             "state": count,
             ATTR_TEMPERATURE: temperature,
-            "battery_level": None,
+            ATTR_BATTERY_LEVEL: None,
         }
 
     def _parse_water_dual_data(self, data: bytes) -> dict:
         """Parse dual-tariff water counter (СВТ-15, СВТ-20)."""
-        # Структура из оригинального кода
-        counter_num = int.from_bytes(data[6:9], byteorder='little')
-        
+        # Одним unpack_from читаем весь заголовок, включая текущий тариф,
+        # если пакет полной длины
+        if len(data) >= _WATER_DUAL_STRUCT_FULL.size:
+            serial, tariff_1_raw, tariff_2_raw, current_tariff = (
+                _WATER_DUAL_FULL_UNPACK(data)
+            )
+        else:
+            serial, tariff_1_raw, tariff_2_raw = _WATER_DUAL_UNPACK(data)
+            # Текущий тариф (предположительно)
+            current_tariff = 1
+
         # Два тарифа
-        tariff_1 = int.from_bytes(data[9:13], byteorder='little') / 1000
-        tariff_2 = int.from_bytes(data[13:17], byteorder='little') / 1000
-        
-        # Текущий тариф (предположительно)
-        current_tariff = data[17] if len(data) > 17 else 1
-        
+        tariff_1 = tariff_1_raw * _SCALE_M3
+        tariff_2 = tariff_2_raw * _SCALE_M3
+
         return {
-            "counter_id": str(counter_num),
+            "counter_id": _counter_id(serial),
             "state": tariff_1 + tariff_2,  # Общее показание
             ATTR_TARIFF_1: tariff_1,
             ATTR_TARIFF_2: tariff_2,
             ATTR_CURRENT_TARIFF: current_tariff,
-            "battery_level": None,
+            ATTR_BATTERY_LEVEL: None,
         }
 
     async def async_stop(self):
-        """Stop scanning."""
-        if self._scanner and self._scanning:
-            await self._scanner.stop()
-            self._scanning = False
+        """Stop scanning.
+
+        Отписка от общего сканера — синхронный вызов без ожиданий,
+        поэтому остановка не может зависнуть и безопасна при повторах.
+        """
+        if self._cancel_callback is not None:
+            self._cancel_callback()
+            self._cancel_callback = None
+        # Освобождаем накопленные кэши (сенсоры к этому моменту уже выгружены)
+        self._last_payload.clear()
+        self._last_parsed.clear()
+        self._mac_type_cache.clear()
+        self.rssi.clear()
+        self.last_seen.clear()
@@ -1,170 +1,184 @@
-"""Sensor platform for Elehant Water."""
-from __future__ import annotations
-
-from datetime import datetime
-import logging
-from typing import Any
-
-from homeassistant.components import bluetooth
-from homeassistant.components.sensor import (
-    SensorDeviceClass,
-    SensorEntity,
-    SensorStateClass,
-)
-from homeassistant.config_entries import ConfigEntry
-from homeassistant.const import (
-    UnitOfVolume,
-    UnitOfTemperature,
-    PERCENTAGE,
-    SIGNAL_STRENGTH_DECIBELS_MILLIWATT,
-)
-from homeassistant.core import HomeAssistant, callback
-from homeassistant.helpers.entity import DeviceInfo
-from homeassistant.helpers.entity_platform import AddEntitiesCallback
-from homeassistant.helpers.update_coordinator import (
-    CoordinatorEntity,
-    DataUpdateCoordinator,
-)
-
-from .const import (
-    CONF_COUNTERS,
-    CONF_COUNTER_ID,
-    CONF_COUNTER_TYPE,
-    CONF_NAME,
-    COUNTER_TYPE_GAS,
-    COUNTER_TYPE_WATER,
-    DATA_COORDINATOR,
-    DATA_DEVICES,
-    DATA_CONFIG,  # ← ЭТО НУЖНО ДОБАВИТЬ
-    DOMAIN,
-    ATTR_BATTERY_LEVEL,
-    ATTR_RSSI,
-    ATTR_LAST_SEEN,
-    ATTR_TEMPERATURE,
-    ATTR_TARIFF_1,
-    ATTR_TARIFF_2,
-    ATTR_CURRENT_TARIFF,
-)
-
-_LOGGER = logging.getLogger(__name__)
-
-
-async def async_setup_entry(
-    hass: HomeAssistant,
-    config_entry: ConfigEntry,
-    async_add_entities: AddEntitiesCallback,
-) -> None:
-    """Set up Elehant sensor entries."""
-    entry_id = config_entry.entry_id
-    data = hass.data[DOMAIN][entry_id]
-    coordinator = data[DATA_COORDINATOR]
-    config = data[DATA_CONFIG]
-    
-    entities = []
-    
-    # Создаем сенсоры для каждого настроенного счетчика
-    for counter_config in config.get(CONF_COUNTERS, []):
-        counter_id = counter_config[CONF_COUNTER_ID]
-        counter_type = counter_config[CONF_COUNTER_TYPE]
-        name = counter_config.get(CONF_NAME, f"Elehant {counter_id}")
-        
-        entities.append(
-            ElehantCounterSensor(
-                coordinator,
-                entry_id,
-                counter_id,
-                counter_type,
-                name,
-            )
-        )
-    
-    if entities:
-        async_add_entities(entities)
-
-
-class ElehantCounterSensor(CoordinatorEntity, SensorEntity):
-    """Representation of an Elehant counter sensor."""
-
-    def __init__(
-        self,
-        coordinator: DataUpdateCoordinator,
-        entry_id: str,
-        counter_id: str,
-        counter_type: str,
-        name: str,
-    ) -> None:
-        """Initialize the sensor."""
-        super().__init__(coordinator)
-        
-        self.entry_id = entry_id
-        self.counter_id = counter_id
-        self.counter_type = counter_type
-        self._attr_name = name
-        self._attr_unique_id = f"{entry_id}_{counter_id}"
-        
-        # Настройка единиц измерения и класса
-        if counter_type == COUNTER_TYPE_GAS:
-            self._attr_native_unit_of_measurement = UnitOfVolume.CUBIC_METERS
-            self._attr_device_class = SensorDeviceClass.GAS
-            self._attr_state_class = SensorStateClass.TOTAL_INCREASING
-        else:  # water
-            self._attr_native_unit_of_measurement = UnitOfVolume.CUBIC_METERS
-            self._attr_device_class = SensorDeviceClass.WATER
-            self._attr_state_class = SensorStateClass.TOTAL_INCREASING
-        
-        self._attr_extra_state_attributes = {}
-        self._available = False
-
-    @property
-    def device_info(self) -> DeviceInfo:
-        """Return device information."""
-        return DeviceInfo(
-            identifiers={(DOMAIN, self.counter_id)},
-            name=self._attr_name,
-            manufacturer="Elehant",
-            model=f"Counter ({self.counter_type})",
-            sw_version="1.0",
-        )
-
-    @property
-    def available(self) -> bool:
-        """Return if entity is available."""
-        return self._available
-
-    @property
-    def native_value(self) -> float | None:
-        """Return the state of the sensor."""
-        if self.coordinator.data:
-            # Ищем наше устройство среди найденных
-            for mac, device_data in self.coordinator.data.items():
-                if device_data.get("counter_id") == self.counter_id:
-                    self._available = True
-                    
-                    # Обновляем атрибуты
-                    self._attr_extra_state_attributes = {
-                        ATTR_RSSI: device_data.get("rssi"),
-                        ATTR_LAST_SEEN: device_data.get("last_seen").isoformat() 
-                            if device_data.get("last_seen") else None,
-                    }
-                    
-                    # Добавляем специфичные атрибуты в зависимости от типа
-                    if ATTR_TEMPERATURE in device_data:
-                        self._attr_extra_state_attributes[ATTR_TEMPERATURE] = device_data[ATTR_TEMPERATURE]
-                    
-                    if ATTR_TARIFF_1 in device_data:
-                        self._attr_extra_state_attributes[ATTR_TARIFF_1] = device_data[ATTR_TARIFF_1]
-                        self._attr_extra_state_attributes[ATTR_TARIFF_2] = device_data[ATTR_TARIFF_2]
-                        self._attr_extra_state_attributes[ATTR_CURRENT_TARIFF] = device_data[ATTR_CURRENT_TARIFF]
-                    
-                    return device_data.get("state")
-            
-            self._available = False
-            return None
-        
-        return None
-
-    @callback
-    def _handle_coordinator_update(self) -> None:
-        """Handle updated data from the coordinator."""
-        self.async_write_ha_state()
-
+"""Sensor platform for Elehant Water."""
+from __future__ import annotations
+
+import logging
+
+from homeassistant.components.sensor import (
+    SensorDeviceClass,
+    SensorEntity,
+    SensorStateClass,
+)
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import UnitOfVolume
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.entity import DeviceInfo
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+from homeassistant.helpers.update_coordinator import (
+    CoordinatorEntity,
+    DataUpdateCoordinator,
+)
+
+from .const import (
+    CONF_COUNTERS,
+    CONF_COUNTER_ID,
+    CONF_COUNTER_TYPE,
+    CONF_NAME,
+    COUNTER_TYPE_GAS,
+    DATA_COORDINATOR,
+    DATA_CONFIG,
+    DATA_SCANNER,
+    DOMAIN,
+    ATTR_RSSI,
+    ATTR_LAST_SEEN,
+    ATTR_TEMPERATURE,
+    ATTR_TARIFF_1,
+    ATTR_TARIFF_2,
+    ATTR_CURRENT_TARIFF,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+async def async_setup_entry(
+    hass: HomeAssistant,
+    config_entry: ConfigEntry,
+    async_add_entities: AddEntitiesCallback,
+) -> None:
+    """Set up Elehant sensor entries."""
+    entry_id = config_entry.entry_id
+    data = hass.data[DOMAIN][entry_id]
+    coordinator = data[DATA_COORDINATOR]
+    scanner = data[DATA_SCANNER]
+    config = data[DATA_CONFIG]
+    
+    entities = []
+    
+    # Создаем сенсоры для каждого настроенного счетчика
+    for counter_config in config.get(CONF_COUNTERS, []):
+        counter_id = counter_config[CONF_COUNTER_ID]
+        counter_type = counter_config[CONF_COUNTER_TYPE]
+        name = counter_config.get(CONF_NAME, f"Elehant {counter_id}")
+        
+        entities.append(
+            ElehantCounterSensor(
+                coordinator,
+                scanner,
+                entry_id,
+                counter_id,
+                counter_type,
+                name,
+            )
+        )
+    
+    if entities:
+        async_add_entities(entities)
+
+
+class ElehantCounterSensor(CoordinatorEntity, SensorEntity):
+    """Representation of an Elehant counter sensor."""
+
+    def __init__(
+        self,
+        coordinator: DataUpdateCoordinator,
+        scanner,
+        entry_id: str,
+        counter_id: str,
+        counter_type: str,
+        name: str,
+    ) -> None:
+        """Initialize the sensor."""
+        super().__init__(coordinator)
+
+        self._scanner = scanner
+        self.entry_id = entry_id
+        self.counter_id = counter_id
+        self.counter_type = counter_type
+        self._attr_name = name
+        self._attr_unique_id = f"{entry_id}_{counter_id}"
+        
+        # Настройка единиц измерения и класса
+        if counter_type == COUNTER_TYPE_GAS:
+            self._attr_native_unit_of_measurement = UnitOfVolume.CUBIC_METERS
+            self._attr_device_class = SensorDeviceClass.GAS
+            self._attr_state_class = SensorStateClass.TOTAL_INCREASING
+        else:  # water
+            self._attr_native_unit_of_measurement = UnitOfVolume.CUBIC_METERS
+            self._attr_device_class = SensorDeviceClass.WATER
+            self._attr_state_class = SensorStateClass.TOTAL_INCREASING
+        
+        self._attr_extra_state_attributes = {}
+        self._available = False
+        # Последнее записанное показание — для отсечки пустых обновлений
+        self._last_reading = None
+
+        # DeviceInfo статичен — собираем один раз, а не на каждое обращение
+        self._attr_device_info = DeviceInfo(
+            identifiers={(DOMAIN, counter_id)},
+            name=name,
+            manufacturer="Elehant",
+            model=f"Counter ({counter_type})",
+            sw_version="1.0",
+        )
+
+    @property
+    def available(self) -> bool:
+        """Return if entity is available."""
+        return self._available
+
+    async def async_added_to_hass(self) -> None:
+        """Prime state from the coordinator's current snapshot."""
+        await super().async_added_to_hass()
+        data = self.coordinator.data
+        self._last_reading = data.get(self.counter_id) if data else None
+        self._update_attrs()
+
+    @callback
+    def _update_attrs(self) -> None:
+        """Собрать состояние и атрибуты из кэшированного показания.
+
+        Вызывается только при смене показания: чтение состояния из
+        state machine дальше идет по готовым _attr_*, без пересборки
+        словаря атрибутов на каждый запрос.
+        """
+        reading = self._last_reading
+        if reading is None:
+            self._available = False
+            self._attr_native_value = None
+            return
+
+        self._available = True
+        self._attr_native_value = reading.state
+
+        # RSSI и last_seen лежат в стороне от данных координатора
+        last_seen = self._scanner.last_seen.get(reading.mac)
+        attrs = {
+            ATTR_RSSI: self._scanner.rssi.get(reading.mac),
+            ATTR_LAST_SEEN: last_seen.isoformat() if last_seen else None,
+        }
+
+        # Добавляем специфичные атрибуты в зависимости от типа
+        if reading.temperature is not None:
+            attrs[ATTR_TEMPERATURE] = reading.temperature
+
+        if reading.tariff_1 is not None:
+            attrs[ATTR_TARIFF_1] = reading.tariff_1
+            attrs[ATTR_TARIFF_2] = reading.tariff_2
+            attrs[ATTR_CURRENT_TARIFF] = reading.current_tariff
+
+        self._attr_extra_state_attributes = attrs
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        """Handle updated data from the coordinator."""
+        data = self.coordinator.data
+        reading = data.get(self.counter_id) if data else None
+        # Координатор будит все сенсоры записи разом; пишем состояние,
+        # только если изменилось именно наше показание (frozen dataclass
+        # сравнивается по полям). RSSI и last_seen меняются молча и
+        # подтянутся при следующей реальной смене показания
+        if reading == self._last_reading:
+            return
+        self._last_reading = reading
+        self._update_attrs()
+        self.async_write_ha_state()
+